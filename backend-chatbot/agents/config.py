@@ -11,6 +11,7 @@ GROQ_MODEL = "llama-3.3-70b-versatile"
 # Gemini Configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "8"))
 
 # Database URLs
 DATABASE_URL = os.getenv("DATABASE_URL")
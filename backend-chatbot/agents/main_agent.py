@@ -1,7 +1,8 @@
 # agents/main_agent.py - Main Orchestrator Agent
 import time
 import logging
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterator
 # from langchain_core.messages import HumanMessage, SystemMessage  # Removed unused imports
 import google.generativeai as genai
 from .cockroachdb_agent import CockroachDBAgent
@@ -11,6 +12,10 @@ from .response_agent import ResponseAgent
 from .config import GEMINI_API_KEY, GEMINI_MODEL
 logger = logging.getLogger(__name__)
 
+# Each /query holds one thread of the request threadpool (40 by default) and
+# runs its first agent there, so it needs at most two more threads here
+AGENT_POOL_WORKERS = 80
+
 class MainAgent:
     """
     Main orchestrator that decides which agents to invoke and coordinates their execution
@@ -62,10 +67,14 @@ Guidelines:
         self.semantic_agent = SemanticAgent()
         self.response_agent = ResponseAgent()
 
+        # Specialized agents are independent, so they run side by side
+        self.executor = ThreadPoolExecutor(max_workers=AGENT_POOL_WORKERS, thread_name_prefix="agent")
+
     def process_query(
         self,
         query: str,
-        conversation_history: Optional[List[Dict[str, str]]] = None
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        include_viz: bool = True
     ) -> Dict[str, Any]:
         """
         Main query processing orchestration
@@ -95,7 +104,8 @@ Guidelines:
             # Step 4: Pass results to Response Agent for final formatting
             final_response = self.response_agent.format_response(
                 query=query,
-                agent_results=agent_results
+                agent_results=agent_results,
+                include_viz=include_viz
             )
 
             return {
@@ -112,6 +122,45 @@ Guidelines:
                 "execution_time": time.time() - start_time
             }
 
+    def stream_query(
+        self,
+        query: str,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        include_viz: bool = True
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of process_query.
+        Yields the ResponseAgent's chunk/viz events and finishes with a
+        {"type": "done", ...} event carrying agents_used and execution_time.
+        """
+        start_time = time.time()
+        agents_used: List[str] = []
+
+        try:
+            agents_decision = self._decide_agents(query, conversation_history)
+
+            if not agents_decision["agents_needed"]:
+                response = self._handle_conversational_query(query, conversation_history)
+                yield {"type": "chunk", "text": response}
+            else:
+                agents_used = agents_decision["agents_needed"]
+                agent_results = self._execute_agents(query, agents_used, conversation_history)
+                yield from self.response_agent.stream_response(
+                    query=query,
+                    agent_results=agent_results,
+                    include_viz=include_viz
+                )
+
+        except Exception as e:
+            logger.error(f"Error in MainAgent stream: {e}")
+            yield {"type": "chunk", "text": f"I encountered an error processing your query: {str(e)}"}
+
+        yield {
+            "type": "done",
+            "agents_used": agents_used,
+            "execution_time": time.time() - start_time
+        }
+
     def _decide_agents(
         self,
         query: str,
@@ -175,22 +224,31 @@ If no agents needed (conversational query), use empty array: []"""
         conversation_history: Optional[List[Dict[str, str]]] = None
     ) -> Dict[str, Any]:
         """
-        Execute the required agents and gather their results
+        Execute the required agents concurrently and gather their results
         """
-        results = {}
-
-        if "cockroachdb" in agents_needed:
-            logger.info("Executing CockroachDBAgent")
-            results["cockroachdb"] = self.cockroach_agent.process(query, conversation_history)
-
-        if "metadata" in agents_needed:
-            logger.info("Executing MetadataAgent")
-            results["metadata"] = self.metadata_agent.process(query, conversation_history)
-
-        if "semantic" in agents_needed:
-            logger.info("Executing SemanticAgent")
-            results["semantic"] = self.semantic_agent.process(query, conversation_history)
-
+        agents = {
+            "cockroachdb": self.cockroach_agent,
+            "metadata": self.metadata_agent,
+            "semantic": self.semantic_agent,
+        }
+
+        selected = [(name, agent) for name, agent in agents.items() if name in agents_needed]
+        if not selected:
+            return {}
+
+        # Hand all but the first agent to the pool and run that one in this
+        # thread, so a single-agent query never waits on the pool
+        futures = {}
+        for name, agent in selected[1:]:
+            logger.info(f"Executing {type(agent).__name__}")
+            futures[name] = self.executor.submit(agent.process, query, conversation_history)
+
+        name, agent = selected[0]
+        logger.info(f"Executing {type(agent).__name__}")
+        results = {name: agent.process(query, conversation_history)}
+
+        for name, future in futures.items():
+            results[name] = future.result()
         return results
 
     def _handle_conversational_query(self, query: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
@@ -221,6 +279,7 @@ Be conversational and natural."""
 
     def close(self):
         """Cleanup resources"""
+        self.executor.shutdown(wait=False)
         self.cockroach_agent.close()
         self.metadata_agent.close()
         self.semantic_agent.close()
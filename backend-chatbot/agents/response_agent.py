@@ -1,20 +1,40 @@
 # agents/response_agent.py - Final Response Formatting Agent
 import logging
+import re
+import hashlib
+import threading
 import time
-import json
-from typing import Dict, Any
+from concurrent.futures import Future
+import orjson
+from collections import Counter, OrderedDict
+from typing import Dict, Any, Iterator, List
 import google.generativeai as genai
-from .config import GEMINI_API_KEY, GEMINI_MODEL
+from .config import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_MAX_CONCURRENT
 
 logger = logging.getLogger(__name__)
 
-class ResponseAgent:
-    """
-    Agent responsible for formatting final responses to users
-    """
-    def __init__(self):
-        genai.configure(api_key=GEMINI_API_KEY)
-        self.system_prompt = """You are an expert oceanographer responsible for presenting data analysis results to users.
+# Phrases that signal the user wants every row rather than a sample
+FULL_DATA_PHRASES = (
+    "whole data", "all data", "complete data", "entire data",
+    "full data", "all measurements", "every measurement",
+    "all rows", "complete list", "entire list"
+)
+# Single-pass, case-insensitive matcher over all of the phrases above
+FULL_DATA_PATTERN = re.compile("|".join(re.escape(p) for p in FULL_DATA_PHRASES), re.IGNORECASE)
+
+# Upper bound on the serialized data sent to Gemini for each agent
+MAX_CTX_BYTES = 60_000
+# Larger result sets are downsampled evenly before serialization
+MAX_CTX_ROWS = 200
+# Largest number of rows any single chart receives
+VIZ_MAX_ROWS = 5000
+# Column names the visualization builder recognizes, compared lowercased
+VIZ_TIME_KEYS = frozenset({"time", "timestamp", "date"})
+VIZ_VALUE_KEYS = frozenset({"temp_adjusted", "psal_adjusted", "pres_adjusted", "temperature", "salinity", "pressure"})
+VIZ_GEO_KEYS = frozenset({"latitude", "longitude"})
+VIZ_GEO_DEPTH_KEYS = frozenset({"latitude", "longitude", "pres_adjusted"})
+
+SYSTEM_PROMPT = """You are an expert oceanographer responsible for presenting data analysis results to users.
 Your task is to take raw data from specialized agents and create a clear, informative response.
 Guidelines:
 1. Provide direct, focused answers to the user's question
@@ -37,25 +57,58 @@ Format numerical data clearly:
 - Round to appropriate decimal places (4-5 decimals for lat/lon, 2-4 for measurements)
 - Include units (°C, PSU, dbar)"""
 
-        self.llm = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            system_instruction=self.system_prompt,
-            generation_config={"temperature": 0.3}
-        )
+# One model is shared by every ResponseAgent so its client and connections are
+# reused across requests; the semaphore bounds concurrent generations to keep
+# bursts of queries from tripping Gemini rate limits
+_gemini_model = None
+_gemini_model_lock = threading.Lock()
+_gemini_semaphore = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENT)
+
+# Generations currently in flight, keyed by prompt digest. Concurrent requests
+# with an identical prompt wait on the same Future instead of calling Gemini again
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+# Completed generations under the same key, most recently used last. The prompt
+# embeds the agent data, so a hit means the same question over the same rows
+_response_cache: "OrderedDict[str, str]" = OrderedDict()
+RESPONSE_CACHE_SIZE = 256
+
+def _dumps(obj: Any, option: int = 0) -> str:
+    """Serialize to a JSON string with orjson, falling back to str() for unknown types"""
+    return orjson.dumps(obj, default=str, option=option | orjson.OPT_NON_STR_KEYS).decode()
+
+def get_model() -> genai.GenerativeModel:
+    """Return the shared Gemini model for response generation, creating it on first use"""
+    global _gemini_model
+    if _gemini_model is None:
+        with _gemini_model_lock:
+            if _gemini_model is None:
+                genai.configure(api_key=GEMINI_API_KEY)
+                _gemini_model = genai.GenerativeModel(
+                    model_name=GEMINI_MODEL,
+                    system_instruction=SYSTEM_PROMPT,
+                    generation_config={"temperature": 0.3}
+                )
+    return _gemini_model
+
+class ResponseAgent:
+    """
+    Agent responsible for formatting final responses to users
+    """
+    def __init__(self):
+        self.system_prompt = SYSTEM_PROMPT
+        self.llm = get_model()
 
-    def format_response(self, query: str, agent_results: Dict[str, Any]) -> str:
+    def format_response(self, query: str, agent_results: Dict[str, Any], include_viz: bool = True) -> str:
         """
-        Format the final response from all agent results
+        Format the final response from all agent results.
+        The visualization block is only built when include_viz is set.
         """
         try:
             logger.info("ResponseAgent formatting final response")
 
             # Check if user wants complete/whole data
-            wants_full_data = any(phrase in query.lower() for phrase in [
-                "whole data", "all data", "complete data", "entire data",
-                "full data", "all measurements", "every measurement",
-                "all rows", "complete list", "entire list"
-            ])
+            wants_full_data = FULL_DATA_PATTERN.search(query) is not None
 
             # Check if we have a large dataset
             result_count = 0
@@ -64,63 +117,27 @@ Format numerical data clearly:
 
             # For large datasets, return a simplified response unless user explicitly asks for all data
             if result_count > 100 and not wants_full_data:
-                start_time = time.time()
                 results = agent_results['cockroachdb']['results']
-                sample_results = results[:10]  # Show a sample
-
-                # Create a simple markdown table for the sample
-                if sample_results:
-                    headers = list(sample_results[0].keys())
-                    table = "| " + " | ".join(headers) + " |\n"
-                    table += "| " + " | ".join(["---"] * len(headers)) + " |\n"
-
-                    for row in sample_results:
-                        table += "| " + " | ".join(str(row.get(h, "")) for h in headers) + " |\n"
-
-                    processing_time = time.time() - start_time
-                    logger.info(f"Formatted sample response in {processing_time:.2f} seconds")
-
-                    base_note = f"The query returned {result_count} rows. Here's a sample of the first 10 rows:\n\n{table}\n\n" + \
-                           f"Note: Only a sample is shown. Total rows: {result_count}. " + \
-                           f"If you need the complete data, please ask for 'all data' or 'complete data'."
+                base_note = self._sample_note(results)
+                if base_note:
                     # Try to attach a visualization spec from the results
-                    viz_block = self._build_visualization_block(results)
+                    viz_block = self._build_visualization_block(results) if include_viz else ""
                     return base_note + ("\n\n" + viz_block if viz_block else "")
                 else:
                     return "No data found for your query."
 
-            # Prepare context from agent results
-            start_time = time.time()
-            context = self._prepare_context(agent_results, include_full_data=wants_full_data)
-            logger.info(f"Prepared context in {time.time() - start_time:.2f} seconds")
-
-            # Add instruction about data completeness
-            data_instruction = ""
-            if wants_full_data:
-                data_instruction = "\n\nIMPORTANT: The user asked for COMPLETE/WHOLE data. Display ALL rows in a markdown table."
-
-            # Generate natural language response with a longer timeout
-            response_prompt = f"""Answer this oceanographic query: "{query}"
-Data from specialized agents:
-{context}{data_instruction}
-Create a clear, concise response that directly answers the user's question using the available data.
-If the data contains many rows, summarize the key findings rather than listing all rows."""
-
+            messages = self._build_messages(query, agent_results, wants_full_data)
             start_time = time.time()
-            messages = [
-                {"role": "user", "parts": [f"{self.system_prompt}\n\n{response_prompt}"]}
-            ]
 
             # Use a longer timeout for the Gemini API
             try:
-                response = self.llm.generate_content(messages, request_options={"timeout": 300})  # 300 seconds timeout
+                nl_text = self._generate(messages)
                 processing_time = time.time() - start_time
                 logger.info(f"Generated response in {processing_time:.2f} seconds")
                 # Try to append visualization spec when we have structured results
-                nl_text = response.text
                 cockroach = agent_results.get('cockroachdb', {})
                 results = cockroach.get('results') or []
-                viz_block = self._build_visualization_block(results)
+                viz_block = self._build_visualization_block(results) if include_viz else ""
                 if viz_block:
                     nl_text += "\n\n" + viz_block
                 return nl_text
@@ -146,8 +163,8 @@ If the data contains many rows, summarize the key findings rather than listing a
                     else:
                         # For regular requests, return a sample
                         sample = results[:10] if len(results) > 10 else results
-                        base = f"The query returned {len(results)} rows. Here's a sample:\n\n{json.dumps(sample, indent=2)}"
-                        viz_block = self._build_visualization_block(results)
+                        base = f"The query returned {len(results)} rows. Here's a sample:\n\n{_dumps(sample, orjson.OPT_INDENT_2)}"
+                        viz_block = self._build_visualization_block(results) if include_viz else ""
                         return base + ("\n\n" + viz_block if viz_block else "")
 
                 return f"Error generating response: {str(gemini_error)}"
@@ -171,12 +188,140 @@ If the data contains many rows, summarize the key findings rather than listing a
                 else:
                     # For regular requests or very large datasets, return a sample
                     sample = results[:10] if len(results) > 10 else results
-                    base = f"The query returned {len(results)} rows. Here's a sample:\n\n{json.dumps(sample, indent=2)}"
-                    viz_block = self._build_visualization_block(results)
+                    base = f"The query returned {len(results)} rows. Here's a sample:\n\n{_dumps(sample, orjson.OPT_INDENT_2)}"
+                    viz_block = self._build_visualization_block(results) if include_viz else ""
                     return base + ("\n\n" + viz_block if viz_block else "")
 
             return f"Error formatting response: {str(e)}"
 
+    def stream_response(self, query: str, agent_results: Dict[str, Any], include_viz: bool = True) -> Iterator[Dict[str, str]]:
+        """
+        Stream the final response as it is generated.
+        Yields {"type": "chunk", "text": ...} events, followed by a single
+        {"type": "viz", "block": ...} event when include_viz is set and a
+        visualization spec is available.
+        """
+        logger.info("ResponseAgent streaming final response")
+
+        wants_full_data = FULL_DATA_PATTERN.search(query) is not None
+
+        cockroach = agent_results.get('cockroachdb') or {}
+        results = cockroach.get('results') or []
+
+        if len(results) > 100 and not wants_full_data:
+            # Large datasets skip the LLM entirely, so there is nothing to stream
+            yield {"type": "chunk", "text": self._sample_note(results)}
+        else:
+            messages = self._build_messages(query, agent_results, wants_full_data)
+            start_time = time.time()
+            try:
+                with _gemini_semaphore:
+                    stream = self.llm.generate_content(messages, stream=True, request_options={"timeout": 300})
+                    for chunk in stream:
+                        if chunk.text:
+                            yield {"type": "chunk", "text": chunk.text}
+                logger.info(f"Streamed response in {time.time() - start_time:.2f} seconds")
+            except Exception as gemini_error:
+                logger.error(f"Gemini API error while streaming: {gemini_error}")
+                yield {"type": "chunk", "text": f"Error generating response: {str(gemini_error)}"}
+
+        viz_block = self._build_visualization_block(results) if include_viz else ""
+        if viz_block:
+            yield {"type": "viz", "block": viz_block}
+
+    def _generate(self, messages: List[Dict[str, Any]]) -> str:
+        """
+        Generate the response text for messages. Recently answered prompts are
+        served from the response cache, and a call that is already running for
+        the same prompt is joined instead of issuing a second Gemini request.
+        """
+        prompt = "".join(part for message in messages for part in message["parts"])
+        key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+
+        with _inflight_lock:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                _response_cache.move_to_end(key)
+                logger.info("Serving response from cache for an identical prompt")
+                return cached
+
+            future = _inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                _inflight[key] = future
+
+        if not is_owner:
+            logger.info("Joining in-flight Gemini generation for an identical prompt")
+            return future.result()
+
+        try:
+            with _gemini_semaphore:
+                response = self.llm.generate_content(messages, request_options={"timeout": 300})  # 300 seconds timeout
+            text = response.text
+            with _inflight_lock:
+                _response_cache[key] = text
+                if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                    _response_cache.popitem(last=False)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with _inflight_lock:
+                del _inflight[key]
+
+    def _sample_note(self, results: List[Dict[str, Any]]) -> str:
+        """
+        Build a markdown note with the first 10 rows of a large result set
+        """
+        start_time = time.time()
+        sample_results = results[:10]  # Show a sample
+        if not sample_results:
+            return ""
+
+        # Create a simple markdown table for the sample
+        headers = list(sample_results[0].keys())
+        table = "| " + " | ".join(headers) + " |\n"
+        table += "| " + " | ".join(["---"] * len(headers)) + " |\n"
+
+        for row in sample_results:
+            table += "| " + " | ".join(str(row.get(h, "")) for h in headers) + " |\n"
+
+        processing_time = time.time() - start_time
+        logger.info(f"Formatted sample response in {processing_time:.2f} seconds")
+
+        result_count = len(results)
+        return f"The query returned {result_count} rows. Here's a sample of the first 10 rows:\n\n{table}\n\n" + \
+               f"Note: Only a sample is shown. Total rows: {result_count}. " + \
+               f"If you need the complete data, please ask for 'all data' or 'complete data'."
+
+    def _build_messages(self, query: str, agent_results: Dict[str, Any], wants_full_data: bool) -> List[Dict[str, Any]]:
+        """
+        Build the Gemini prompt messages for the final response
+        """
+        # Prepare context from agent results
+        start_time = time.time()
+        context = self._prepare_context(agent_results, include_full_data=wants_full_data)
+        logger.info(f"Prepared context in {time.time() - start_time:.2f} seconds")
+
+        # Add instruction about data completeness
+        data_instruction = ""
+        if wants_full_data:
+            data_instruction = "\n\nIMPORTANT: The user asked for COMPLETE/WHOLE data. Display ALL rows in a markdown table."
+
+        # Generate natural language response with a longer timeout
+        response_prompt = f"""Answer this oceanographic query: "{query}"
+Data from specialized agents:
+{context}{data_instruction}
+Create a clear, concise response that directly answers the user's question using the available data.
+If the data contains many rows, summarize the key findings rather than listing all rows."""
+
+        return [
+            {"role": "user", "parts": [f"{self.system_prompt}\n\n{response_prompt}"]}
+        ]
+
     def _prepare_context(self, agent_results: Dict[str, Any], include_full_data: bool = False) -> str:
         """
         Prepare context string from agent results
@@ -196,19 +341,35 @@ If the data contains many rows, summarize the key findings rather than listing a
                     # For large datasets, limit the context to prevent overwhelming the LLM
                     if result_count > 100:
                         context_parts.append("FULL DATA (sample of first 10 rows):")
-                        context_parts.append(json.dumps(results[:10], indent=2, default=str))
+                        context_parts.append(self._context_json(results[:10]))
                     else:
                         context_parts.append("FULL DATA (all rows):")
-                        context_parts.append(json.dumps(results, indent=2, default=str))
+                        context_parts.append(self._context_json(results))
                 else:
-                    # Normal summary
-                    context_parts.append(json.dumps(result, indent=2, default=str))
+                    # Normal summary, with long result lists thinned out evenly so the
+                    # LLM still sees the spread of the data rather than just its head
+                    results = result.get("results")
+                    if isinstance(results, list) and len(results) > MAX_CTX_ROWS:
+                        step = -(-len(results) // MAX_CTX_ROWS)
+                        sampled = results[::step]
+                        context_parts.append(f"(results sampled evenly: {len(sampled)} of {len(results)} rows)")
+                        result = {**result, "results": sampled}
+                    context_parts.append(self._context_json(result))
 
         if not context_parts:
             return "No data available from agents"
 
         return "\n".join(context_parts)
 
+    def _context_json(self, data: Any) -> str:
+        """
+        Serialize data compactly for the LLM prompt, capped at MAX_CTX_BYTES
+        """
+        text = _dumps(data)
+        if len(text) > MAX_CTX_BYTES:
+            text = text[:MAX_CTX_BYTES] + '...[truncated]'
+        return text
+
     def _build_visualization_block(self, results: Any) -> str:
         """
         Build an advanced visualization spec block in a code fence that the frontend can parse.
@@ -221,13 +382,27 @@ If the data contains many rows, summarize the key findings rather than listing a
             # Infer available fields
             sample = results[0]
             fields = list(sample.keys())
-            fset = set([f.lower() for f in fields])
+            fset = {f.lower() for f in fields}
+
+            # Columnar view of the results, extracted once per field. Each chart
+            # then gets rows holding only the fields it encodes rather than
+            # every column of every row, which keeps the viz payload small
+            columns: Dict[str, List[Any]] = {}
+
+            def chart_data(chart_fields: List[str], limit: int) -> Dict[str, Any]:
+                present = [f for f in chart_fields if f in sample]
+                for f in present:
+                    if f not in columns:
+                        columns[f] = [row.get(f) for row in results[:VIZ_MAX_ROWS]]
+                n = min(limit, len(results))
+                rows = [dict(zip(present, values)) for values in zip(*(columns[f][:n] for f in present))]
+                return {"fields": chart_fields, "rows": rows}
 
             visualizations = []
 
             # Advanced time series with multiple metrics
-            time_key = next((f for f in fields if f.lower() in ["time", "timestamp", "date"]), None)
-            value_candidates = [f for f in fields if f.lower() in ["temp_adjusted", "psal_adjusted", "pres_adjusted", "temperature", "salinity", "pressure"]]
+            time_key = next((f for f in fields if f.lower() in VIZ_TIME_KEYS), None)
+            value_candidates = [f for f in fields if f.lower() in VIZ_VALUE_KEYS]
             
             if time_key and value_candidates:
                 # Single metric line chart
@@ -236,7 +411,7 @@ If the data contains many rows, summarize the key findings rather than listing a
                         "type": "line",
                         "title": f"{val.replace('_', ' ').title()} Over Time",
                         "subtitle": f"Time series analysis of {val} measurements",
-                        "data": {"fields": [time_key, val], "rows": results[:500]},
+                        "data": chart_data([time_key, val], 500),
                         "encodings": {"x": time_key, "y": val},
                         "options": {
                             "tooltip": True, 
@@ -259,7 +434,7 @@ If the data contains many rows, summarize the key findings rather than listing a
                         "type": "area",
                         "title": "Temperature Profile Trend",
                         "subtitle": "Temperature variations over time with gradient fill",
-                        "data": {"fields": [time_key, "temp_adjusted"], "rows": results[:500]},
+                        "data": chart_data([time_key, "temp_adjusted"], 500),
                         "encodings": {"x": time_key, "y": "temp_adjusted"},
                         "options": {
                             "tooltip": True,
@@ -278,7 +453,7 @@ If the data contains many rows, summarize the key findings rather than listing a
                         "type": "scatter",
                         "title": f"{y_key.replace('_', ' ').title()} vs Pressure Profile",
                         "subtitle": f"Depth-pressure relationship analysis for {y_key}",
-                        "data": {"fields": ["pres_adjusted", y_key], "rows": results[:1000]},
+                        "data": chart_data(["pres_adjusted", y_key], 1000),
                         "encodings": {"x": "pres_adjusted", "y": y_key},
                         "options": {
                             "tooltip": True,
@@ -295,7 +470,7 @@ If the data contains many rows, summarize the key findings rather than listing a
                     "type": "composed",
                     "title": "Multi-Parameter Oceanographic Profile",
                     "subtitle": "Combined view of temperature, salinity, and pressure over time",
-                    "data": {"fields": [time_key, "temp_adjusted", "psal_adjusted"], "rows": results[:300]},
+                    "data": chart_data([time_key, "temp_adjusted", "psal_adjusted"], 300),
                     "encodings": {"x": time_key, "y1": "temp_adjusted", "y2": "psal_adjusted"},
                     "options": {
                         "tooltip": True,
@@ -307,13 +482,13 @@ If the data contains many rows, summarize the key findings rather than listing a
                 })
 
             # Advanced map visualizations
-            if "latitude" in fset and "longitude" in fset:
+            if VIZ_GEO_KEYS <= fset:
                 # Enhanced map points with better styling
                 visualizations.append({
                     "type": "map_points",
                     "title": "Argo Float Deployment Locations",
                     "subtitle": "Geographic distribution of oceanographic measurement points",
-                    "data": {"fields": ["latitude", "longitude"], "rows": results[:2000]},
+                    "data": chart_data(["latitude", "longitude"], 2000),
                     "encodings": {"lat": "latitude", "lon": "longitude"},
                     "options": {
                         "tooltip": True,
@@ -329,7 +504,7 @@ If the data contains many rows, summarize the key findings rather than listing a
                         "type": "heatmap",
                         "title": f"Spatial Temperature Distribution",
                         "subtitle": f"Heat map showing {color_key} variations across geographic regions",
-                        "data": {"fields": ["latitude", "longitude", color_key], "rows": results[:5000]},
+                        "data": chart_data(["latitude", "longitude", color_key], 5000),
                         "encodings": {"lat": "latitude", "lon": "longitude", "value": color_key},
                         "options": {
                             "tooltip": True,
@@ -339,12 +514,12 @@ If the data contains many rows, summarize the key findings rather than listing a
                     })
 
             # Advanced 3D visualizations
-            if {"latitude", "longitude", "pres_adjusted"}.issubset(fset):
+            if VIZ_GEO_DEPTH_KEYS <= fset:
                 visualizations.append({
                     "type": "scatter3d",
                     "title": "3D Oceanographic Profile",
                     "subtitle": "Interactive 3D visualization of latitude, longitude, and pressure depth",
-                    "data": {"fields": ["latitude", "longitude", "pres_adjusted"], "rows": results[:3000]},
+                    "data": chart_data(["latitude", "longitude", "pres_adjusted"], 3000),
                     "encodings": {"x": "longitude", "y": "latitude", "z": "pres_adjusted"},
                     "options": {
                         "tooltip": True,
@@ -356,13 +531,9 @@ If the data contains many rows, summarize the key findings rather than listing a
 
             # Bar chart for statistical summaries
             if len(results) > 10:
-                # Create summary data for bar chart
-                platform_counts = {}
-                for row in results:
-                    platform = row.get('platform_number', 'Unknown')
-                    platform_counts[platform] = platform_counts.get(platform, 0) + 1
-                
-                summary_data = [{"platform": k, "measurements": v} for k, v in list(platform_counts.items())[:10]]
+                # Create summary data for bar chart from the 10 busiest platforms
+                platform_counts = Counter(row.get('platform_number', 'Unknown') for row in results)
+                summary_data = [{"platform": k, "measurements": v} for k, v in platform_counts.most_common(10)]
                 if summary_data:
                     visualizations.append({
                         "type": "bar",
@@ -382,7 +553,7 @@ If the data contains many rows, summarize the key findings rather than listing a
                 return ""
 
             payload = {"visualizations": visualizations}
-            fenced = "```viz\n" + json.dumps(payload, default=str) + "\n```"
+            fenced = "```viz\n" + _dumps(payload) + "\n```"
             return fenced
         except Exception as e:
             logger.error(f"Failed building visualization block: {e}")
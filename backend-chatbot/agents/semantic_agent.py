@@ -68,11 +68,15 @@ class SemanticAgent:
             import hashlib
             query_hash = hashlib.md5(query.lower().encode()).hexdigest()
             seed = int(query_hash[:8], 16)
-            np.random.seed(seed)
-            embedding = np.random.normal(0, 0.1, 384)
+            # A per-call generator keeps the process-wide RNG state untouched,
+            # which matters now that queries are served from several threads
+            rng = np.random.default_rng(seed)
+            embedding = np.empty(384, dtype=np.float32)
+            rng.standard_normal(dtype=np.float32, out=embedding)
+            embedding *= 0.1
             norm = np.linalg.norm(embedding)
             if norm > 0:
-                embedding = embedding / norm
+                embedding /= norm  # in place, no second 384-element array
             return embedding.tolist()
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
@@ -4,9 +4,13 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import logging
 import uuid
+import orjson
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from agents.main_agent import MainAgent
 from session_manager import SessionManager
@@ -35,12 +39,14 @@ async def lifespan(app: FastAPI):
     if main_agent:
         main_agent.close()
     if session_manager:
+        session_manager.close()
         session_manager.cleanup_all()
     logger.info("Application shutdown complete")
 
 app = FastAPI(
     title="Oceanographic Data Analysis API",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -51,8 +57,13 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Responses carry markdown tables and viz blocks, which compress very well
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 class QueryRequest(BaseModel):
     query: str
+    # Clients that do not render charts can skip building the viz block
+    include_viz: bool = True
 
 class QueryResponse(BaseModel):
     response: str
@@ -92,10 +103,12 @@ async def process_query(
         # Get conversation history from session
         conversation_history = session_manager.get_conversation_history(session_id)
         
-        # Process query
-        result = main_agent.process_query(
+        # Process query off the event loop; the agents block on Gemini and the databases
+        result = await run_in_threadpool(
+            main_agent.process_query,
             query=request.query,
-            conversation_history=conversation_history
+            conversation_history=conversation_history,
+            include_viz=request.include_viz
         )
         
         # Update session with new query and response
@@ -110,6 +123,54 @@ async def process_query(
         logger.error(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def stream_query(
+    request: QueryRequest,
+    session_id: Optional[str] = Header(None, alias="X-Session-ID")
+):
+    """
+    Stream the response to a query as server-sent events.
+    Emits "chunk" events as text is generated, an optional "viz" event with the
+    visualization block, and a final "done" event with the query metadata.
+    """
+    # Create session if not provided
+    if not session_id:
+        session_id = session_manager.create_session()
+        logger.info(f"Created new session: {session_id}")
+
+    try:
+        conversation_history = session_manager.get_conversation_history(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    def event_stream():
+        response_parts = []
+        try:
+            for event in main_agent.stream_query(
+                query=request.query,
+                conversation_history=conversation_history,
+                include_viz=request.include_viz
+            ):
+                if event["type"] == "chunk":
+                    response_parts.append(event["text"])
+                elif event["type"] == "viz":
+                    response_parts.append("\n\n" + event["block"])
+                elif event["type"] == "done":
+                    event["session_id"] = session_id
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+        finally:
+            # Record the exchange even if the client disconnects mid-stream
+            session_manager.add_message(session_id, "user", request.query)
+            session_manager.add_message(session_id, "assistant", "".join(response_parts))
+
+    # Marking the stream as already encoded keeps GZipMiddleware from buffering
+    # events inside the compressor before they reach the client
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Content-Encoding": "identity"}
+    )
+
 @app.get("/session/{session_id}/history")
 async def get_session_history(session_id: str):
     """
@@ -143,4 +204,12 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # uvicorn[standard] supplies uvloop and httptools, which the default "auto"
+    # loop/http settings pick up wherever they are available. Run a single
+    # worker: sessions live in this process's SessionManager, so a second
+    # process would neither see them nor know when they were last used.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001
+    )
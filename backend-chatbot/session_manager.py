@@ -1,50 +1,202 @@
 import uuid
 import os
-import json
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+import heapq
+import struct
+import msgpack
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
 import threading
+import time
 import logging
 import shutil
 
 logger = logging.getLogger(__name__)
 
+# Number of per-session lock stripes (power of two)
+LOCK_STRIPES = 64
+# How often buffered log records are written out, in seconds
+FLUSH_INTERVAL = 0.25
+
 class SessionManager:
     """
-    Manages user sessions and conversation history with file-based storage
+    Manages user sessions and conversation history.
+    Sessions live in memory; each one is backed by an append-only log file
+    (a header record followed by one record per message) that is replayed
+    on startup. Records are buffered and appended by a background flusher,
+    so callers never wait on disk.
     """
     def __init__(self, expiry_minutes: int = 30):
-        self.sessions_dir = "/sessions"  # Directory to store session files
+        self.sessions_dir = "/sessions"  # Directory to store session logs
         self.expiry_minutes = expiry_minutes
-        self.lock = threading.Lock()
+        self.lock = threading.Lock()  # Guards whole-store operations (cleanup)
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._cache: Dict[str, dict] = {}
+        # Wall-clock time of each session's last use, kept in memory only
+        self._last_touch: Dict[str, float] = {}
+        # Log records not yet written, by session; its keys are the dirty sessions
+        self._dirty: Dict[str, List[dict]] = {}
+        # (due time, session_id) min-heap driving expiry. Entries are only
+        # checked when due; a session used since is pushed back, not expired
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._expiry_cond = threading.Condition()
+        self._closed = threading.Event()  # Stops the flush thread
 
         # Create sessions directory if it doesn't exist
         os.makedirs(self.sessions_dir, exist_ok=True)
+        self._load_sessions()
 
-        # Start cleanup thread
+        # Start background threads
         self._start_cleanup_thread()
+        self._start_flush_thread()
+
+    def _lock_for(self, session_id: str) -> threading.Lock:
+        """Get the stripe lock guarding a session"""
+        return self._stripes[hash(session_id) & (LOCK_STRIPES - 1)]
 
     def _get_session_path(self, session_id: str) -> str:
         """Get the file path for a session"""
-        return os.path.join(self.sessions_dir, f"{session_id}.json")
+        return os.path.join(self.sessions_dir, f"{session_id}.log")
+
+    @staticmethod
+    def _append_records(session_path: str, records: List[dict]):
+        """Append length-prefixed msgpack records to a session log in one write"""
+        chunks = []
+        for record in records:
+            payload = msgpack.packb(record, use_bin_type=True)
+            chunks.append(struct.pack(">I", len(payload)))
+            chunks.append(payload)
+        with open(session_path, 'ab') as f:
+            f.write(b"".join(chunks))
+
+    def _flush_session(self, session_id: str):
+        """Write a session's buffered records to its log"""
+        with self._lock_for(session_id):
+            records = self._dirty.pop(session_id, None)
+            if records:
+                self._append_records(self._get_session_path(session_id), records)
+
+    def flush(self):
+        """
+        Write every buffered record to disk
+        """
+        for session_id in list(self._dirty):
+            try:
+                self._flush_session(session_id)
+            except Exception as e:
+                logger.error(f"Error flushing session {session_id}: {e}")
+
+    @staticmethod
+    def _read_records(session_path: str) -> Tuple[List[dict], int, int]:
+        """
+        Read every complete record from a session log.
+        Returns the records, the offset just past the last complete one and
+        the file size; they differ when the final write was torn.
+        """
+        with open(session_path, 'rb') as f:
+            data = f.read()
+
+        records = []
+        offset = 0
+        while offset + 4 <= len(data):
+            (size,) = struct.unpack_from(">I", data, offset)
+            if offset + 4 + size > len(data):
+                break  # Torn final write, drop it
+            records.append(msgpack.unpackb(data[offset + 4:offset + 4 + size], raw=False))
+            offset += 4 + size
+        return records, offset, len(data)
+
+    def _load_sessions(self):
+        """
+        Replay session logs left by a previous run into the in-memory cache.
+        Logs already past expiry are removed by mtime without being parsed.
+        """
+        expiry = self.expiry_minutes * 60
+        now = time.time()
+        expired = 0
+
+        with os.scandir(self.sessions_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".log"):
+                    continue
+                session_id = entry.name[:-4]  # Remove .log extension
+                mtime = entry.stat().st_mtime
+
+                if now - mtime > expiry:
+                    os.remove(entry.path)
+                    expired += 1
+                    continue
+
+                try:
+                    records, end, size = self._read_records(entry.path)
+                    if end < size:
+                        # Cut off the torn tail, or the next append would land
+                        # after it and make the log unreadable
+                        os.truncate(entry.path, end)
+                        logger.warning(f"Dropped a torn record from session {session_id}")
+                except Exception as e:
+                    logger.error(f"Could not replay session {session_id}: {e}")
+                    continue
+                if not records:
+                    continue
+
+                header, messages = records[0], records[1:]
+                if not isinstance(header, dict) or "created_at" not in header:
+                    # Without its header the log cannot be replayed
+                    logger.error(f"Session log {session_id} has no header, removing it")
+                    os.remove(entry.path)
+                    continue
+                self._cache[session_id] = {
+                    "created_at": header["created_at"],
+                    "conversation_history": messages
+                }
+                self._last_touch[session_id] = mtime
+                self._schedule_expiry(session_id, mtime + expiry)
+
+        if expired:
+            logger.info(f"Removed {expired} expired sessions on startup")
+        if self._cache:
+            logger.info(f"Restored {len(self._cache)} sessions")
+
+    def _last_access(self, session_id: str) -> float:
+        """
+        Last use of a session, falling back to its log's mtime for sessions
+        restored from a previous run
+        """
+        touched = self._last_touch.get(session_id)
+        if touched is not None:
+            return touched
+        try:
+            return os.path.getmtime(self._get_session_path(session_id))
+        except OSError:
+            return 0.0
+
+    def _schedule_expiry(self, session_id: str, due: float):
+        """Queue a session to be checked for expiry at time due"""
+        with self._expiry_cond:
+            heapq.heappush(self._expiry_heap, (due, session_id))
+            self._expiry_cond.notify()
 
     def create_session(self) -> str:
         """
         Create a new session and return session ID
         """
         session_id = str(uuid.uuid4())
-        session_path = self._get_session_path(session_id)
 
-        with self.lock:
-            session_data = {
-                "created_at": datetime.now().isoformat(),
-                "last_accessed": datetime.now().isoformat(),
+        # One clock read serves the timestamp, last use and expiry
+        now = time.time()
+        created_at = datetime.fromtimestamp(now).isoformat()
+
+        with self._lock_for(session_id):
+            self._cache[session_id] = {
+                "created_at": created_at,
                 "conversation_history": []
             }
+            self._last_touch[session_id] = now
+
+            # The session log starts with its header record
+            self._dirty[session_id] = [{"created_at": created_at}]
 
-            # Save session to file
-            with open(session_path, 'w') as f:
-                json.dump(session_data, f)
+        self._schedule_expiry(session_id, now + self.expiry_minutes * 60)
 
         logger.info(f"Created session: {session_id}")
         return session_id
@@ -53,53 +205,38 @@ class SessionManager:
         """
         Get conversation history for a session
         """
-        session_path = self._get_session_path(session_id)
-
-        with self.lock:
-            if not os.path.exists(session_path):
+        with self._lock_for(session_id):
+            session_data = self._cache.get(session_id)
+            if session_data is None:
                 logger.warning(f"Session {session_id} not found")
                 raise ValueError(f"Session {session_id} not found or expired")
 
-            # Load session from file
-            with open(session_path, 'r') as f:
-                session_data = json.load(f)
+            self._last_touch[session_id] = time.time()
 
-            # Update last accessed time
-            session_data["last_accessed"] = datetime.now().isoformat()
-
-            # Save updated session
-            with open(session_path, 'w') as f:
-                json.dump(session_data, f)
-
-            return session_data["conversation_history"]
+            return list(session_data["conversation_history"])
 
     def add_message(self, session_id: str, role: str, content: str):
         """
         Add a message to session conversation history
         """
-        session_path = self._get_session_path(session_id)
-
-        with self.lock:
-            if not os.path.exists(session_path):
+        with self._lock_for(session_id):
+            session_data = self._cache.get(session_id)
+            if session_data is None:
                 raise ValueError(f"Session {session_id} not found")
 
-            # Load session from file
-            with open(session_path, 'r') as f:
-                session_data = json.load(f)
-
-            # Add new message
-            session_data["conversation_history"].append({
+            # One clock read serves both the message timestamp and last use
+            now = time.time()
+            message = {
                 "role": role,
                 "content": content,
-                "timestamp": datetime.now().isoformat()
-            })
+                "timestamp": datetime.fromtimestamp(now).isoformat()
+            }
 
-            # Update last accessed time
-            session_data["last_accessed"] = datetime.now().isoformat()
+            # Add it in memory and queue just the new message for the log
+            session_data["conversation_history"].append(message)
+            self._dirty.setdefault(session_id, []).append(message)
 
-            # Save updated session
-            with open(session_path, 'w') as f:
-                json.dump(session_data, f)
+            self._last_touch[session_id] = now
 
     def delete_session(self, session_id: str):
         """
@@ -107,62 +244,95 @@ class SessionManager:
         """
         session_path = self._get_session_path(session_id)
 
-        with self.lock:
-            if os.path.exists(session_path):
-                os.remove(session_path)
+        with self._lock_for(session_id):
+            self._last_touch.pop(session_id, None)
+            self._dirty.pop(session_id, None)
+            if self._cache.pop(session_id, None) is not None:
+                if os.path.exists(session_path):
+                    os.remove(session_path)
                 logger.info(f"Deleted session: {session_id}")
             else:
                 raise ValueError(f"Session {session_id} not found")
 
     def cleanup_expired_sessions(self):
         """
-        Remove expired sessions
+        Remove expired sessions whose expiry check is due
         """
         with self.lock:
-            now = datetime.now()
-            expired_sessions = []
+            expiry = self.expiry_minutes * 60
+            now = time.time()
+            removed = 0
 
-            # Get all session files
-            for filename in os.listdir(self.sessions_dir):
-                if filename.endswith(".json"):
-                    session_id = filename[:-5]  # Remove .json extension
+            while True:
+                with self._expiry_cond:
+                    if not self._expiry_heap or self._expiry_heap[0][0] > now:
+                        break
+                    _, session_id = heapq.heappop(self._expiry_heap)
+
+                with self._lock_for(session_id):
+                    if session_id not in self._cache:
+                        continue  # Already deleted
+
+                    # Used since this entry was queued; check again later
+                    due = self._last_access(session_id) + expiry
+                    if due > now:
+                        self._schedule_expiry(session_id, due)
+                        continue
+
+                    del self._cache[session_id]
+                    self._last_touch.pop(session_id, None)
+                    self._dirty.pop(session_id, None)
                     session_path = self._get_session_path(session_id)
-
-                    # Load session data
-                    with open(session_path, 'r') as f:
-                        session_data = json.load(f)
-
-                    last_accessed = datetime.fromisoformat(session_data["last_accessed"])
-                    if now - last_accessed > timedelta(minutes=self.expiry_minutes):
-                        expired_sessions.append(session_path)
-
-            # Delete expired sessions
-            for session_path in expired_sessions:
-                session_id = os.path.basename(session_path)[:-5]  # Extract session_id
-                os.remove(session_path)
+                    if os.path.exists(session_path):
+                        os.remove(session_path)
+                removed += 1
                 logger.info(f"Expired session removed: {session_id}")
 
-            if expired_sessions:
-                logger.info(f"Cleaned up {len(expired_sessions)} expired sessions")
+            if removed:
+                logger.info(f"Cleaned up {removed} expired sessions")
+
+    def close(self):
+        """
+        Stop the flush thread and write out every buffered record (for shutdown)
+        """
+        self._closed.set()
+        self._flush_thread.join()
+        self.flush()
 
     def cleanup_all(self):
         """
         Clear all sessions (for shutdown)
         """
         with self.lock:
-            if os.path.exists(self.sessions_dir):
-                shutil.rmtree(self.sessions_dir)
-                os.makedirs(self.sessions_dir, exist_ok=True)  # Recreate directory
-                logger.info("All sessions cleared")
+            # Hold every stripe so no flush can recreate a log mid-wipe
+            for stripe in self._stripes:
+                stripe.acquire()
+            try:
+                self._cache.clear()
+                self._last_touch.clear()
+                self._dirty.clear()
+                with self._expiry_cond:
+                    self._expiry_heap.clear()
+                if os.path.exists(self.sessions_dir):
+                    shutil.rmtree(self.sessions_dir)
+                    os.makedirs(self.sessions_dir, exist_ok=True)  # Recreate directory
+                    logger.info("All sessions cleared")
+            finally:
+                for stripe in self._stripes:
+                    stripe.release()
 
     def _start_cleanup_thread(self):
         """
-        Start background thread for cleaning up expired sessions
+        Start background thread for cleaning up expired sessions.
+        It sleeps until the earliest queued expiry instead of polling.
         """
         def cleanup_loop():
-            import time
             while True:
-                time.sleep(300)  # Check every 5 minutes
+                with self._expiry_cond:
+                    if self._expiry_heap:
+                        self._expiry_cond.wait(max(0.0, self._expiry_heap[0][0] - time.time()))
+                    else:
+                        self._expiry_cond.wait()
                 try:
                     self.cleanup_expired_sessions()
                 except Exception as e:
@@ -171,3 +341,15 @@ class SessionManager:
         thread = threading.Thread(target=cleanup_loop, daemon=True)
         thread.start()
         logger.info("Session cleanup thread started")
+
+    def _start_flush_thread(self):
+        """
+        Start background thread that writes buffered log records
+        """
+        def flush_loop():
+            while not self._closed.wait(FLUSH_INTERVAL):
+                self.flush()
+
+        self._flush_thread = threading.Thread(target=flush_loop, daemon=True)
+        self._flush_thread.start()
+        logger.info("Session flush thread started")
\ No newline at end of file
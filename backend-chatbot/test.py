@@ -19,11 +19,13 @@ class OceanographicAPIClient:
         self.base_url = base_url
         self.session_id: Optional[str] = None
         self.query_count = 0
+        # Reuse one keep-alive connection across turns
+        self.http = requests.Session()
         
     def create_session(self) -> bool:
         """Create a new session"""
         try:
-            response = requests.post(f"{self.base_url}/session/create")
+            response = self.http.post(f"{self.base_url}/session/create")
             response.raise_for_status()
             
             data = response.json()
@@ -47,7 +49,7 @@ class OceanographicAPIClient:
             if self.session_id:
                 headers["X-Session-ID"] = self.session_id
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/query",
                 json={"query": query},
                 headers=headers
@@ -74,7 +76,7 @@ class OceanographicAPIClient:
             if not self.session_id:
                 return {"error": "No active session"}
             
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/session/{self.session_id}/history"
             )
             response.raise_for_status()
@@ -89,7 +91,7 @@ class OceanographicAPIClient:
             if not self.session_id:
                 return False
             
-            response = requests.delete(
+            response = self.http.delete(
                 f"{self.base_url}/session/{self.session_id}"
             )
             response.raise_for_status()
@@ -3,6 +3,7 @@ Tool factory and common interfaces for the Argo data tools.
 Provides a unified interface to access all tools and handle initialization/cleanup.
 """
 
+import threading
 from typing import Optional
 from .cockroach_tool import CockroachDBTool
 from .neo4j_tool import Neo4jTool
@@ -15,27 +16,44 @@ class ArgoToolFactory:
         self._cockroach_tool: Optional[CockroachDBTool] = None
         self._neo4j_tool: Optional[Neo4jTool] = None
         self._pinecone_tool: Optional[PineconeTool] = None
+        # One lock per tool, so a slow connect to one backend doesn't hold up the others.
+        # Properties check without the lock first; only first use pays for it.
+        self._cockroach_lock = threading.Lock()
+        self._neo4j_lock = threading.Lock()
+        self._pinecone_lock = threading.Lock()
 
     @property
     def cockroach(self) -> CockroachDBTool:
         """Get CockroachDB tool instance"""
-        if self._cockroach_tool is None:
-            self._cockroach_tool = CockroachDBTool()
-        return self._cockroach_tool
+        tool = self._cockroach_tool
+        if tool is None:
+            with self._cockroach_lock:
+                if self._cockroach_tool is None:
+                    self._cockroach_tool = CockroachDBTool()
+                tool = self._cockroach_tool
+        return tool
 
     @property
     def neo4j(self) -> Neo4jTool:
         """Get Neo4j tool instance"""
-        if self._neo4j_tool is None:
-            self._neo4j_tool = Neo4jTool()
-        return self._neo4j_tool
+        tool = self._neo4j_tool
+        if tool is None:
+            with self._neo4j_lock:
+                if self._neo4j_tool is None:
+                    self._neo4j_tool = Neo4jTool()
+                tool = self._neo4j_tool
+        return tool
 
     @property
     def pinecone(self) -> PineconeTool:
         """Get Pinecone tool instance"""
-        if self._pinecone_tool is None:
-            self._pinecone_tool = PineconeTool()
-        return self._pinecone_tool
+        tool = self._pinecone_tool
+        if tool is None:
+            with self._pinecone_lock:
+                if self._pinecone_tool is None:
+                    self._pinecone_tool = PineconeTool()
+                tool = self._pinecone_tool
+        return tool
 
     def close_all(self):
         """Close all tool connections"""
@@ -1,11 +1,18 @@
 # main.py (Updated for Cached Float Data)
 import os
-from fastapi import FastAPI
+import asyncio
+import gzip
+import threading
+import time
+from collections import OrderedDict
+import orjson
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 
 # --- 1. INITIALIZE APP & LOAD ENV ---
@@ -26,9 +33,46 @@ app.add_middleware(
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set in the .env file")
-engine = create_engine(DATABASE_URL)
+# One pool shared by all endpoints; pre-ping drops connections the cluster has closed
+engine = create_engine(DATABASE_URL, pool_size=8, max_overflow=8, pool_pre_ping=True)
 print("FastAPI connected to the database (CockroachDB).")
 
+# SQL statements are built once at import and reused by every call
+QUERY_LATEST_FLOATS = text("""
+    WITH latest_measurements AS (
+        SELECT *,
+               ROW_NUMBER() OVER (PARTITION BY platform_number ORDER BY time DESC) AS rn
+        FROM argo_measurements
+        WHERE DATE_TRUNC('month', time) = (
+            SELECT DATE_TRUNC('month', MAX(time))
+            FROM argo_measurements
+        )
+    )
+    SELECT platform_number AS id, latitude, longitude, time AS "lastReported"
+    FROM latest_measurements
+    WHERE rn = 1;
+""")
+
+QUERY_ROW_COUNT = text("SELECT COUNT(*) as count FROM argo_measurements LIMIT 1")
+
+QUERY_TEST_FLOATS = text("""
+    SELECT 
+        platform_number AS id,
+        latitude,
+        longitude,
+        time AS "lastReported"
+    FROM argo_measurements
+    LIMIT 5;
+""")
+
+QUERY_FLOAT_DETAILS = text("""
+    SELECT platform_number, time, latitude, longitude,
+           temp_adjusted, psal_adjusted, pres_adjusted
+    FROM argo_measurements
+    WHERE platform_number = :id
+    ORDER BY time;
+""")
+
 # --- 4. PYDANTIC MODELS ---
 class MeasurementPoint(BaseModel):
     date: str
@@ -53,52 +97,74 @@ class FloatLocation(BaseModel):
 
 # --- 5. GLOBAL CACHE ---
 float_cache: list[dict] = []  # Cache for pre-fetched float locations
+floats_bytes: bytes = b"[]"  # float_cache serialized once for /api/floats
+floats_gzip: bytes = gzip.compress(floats_bytes)  # ...and gzip-compressed once
+float_refresh_lock = threading.Lock()  # One cache rebuild at a time
+FLOAT_CACHE_REFRESH_SECONDS = int(os.getenv("FLOAT_CACHE_REFRESH_SECONDS", "600"))
+FLOAT_CACHE_CHUNK_ROWS = 10000  # Rows fetched per round trip while loading
+
+# Serialized /api/float/{float_id} responses: float_id -> (expires_at, body), least recently used first
+FLOAT_DETAIL_CACHE_SIZE = 512
+FLOAT_DETAIL_CACHE_TTL = 60  # seconds
+float_detail_cache: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+float_detail_lock = threading.Lock()
 
 # --- 6. FUNCTION TO LOAD FLOATS INTO CACHE ---
 def load_float_cache():
-    """Fetch latest floats from DB and store in global cache"""
-    global float_cache
-    try:
-        print("🌊 Loading float cache at startup...")
-
-        query = text("""
-            WITH latest_measurements AS (
-                SELECT *,
-                       ROW_NUMBER() OVER (PARTITION BY platform_number ORDER BY time DESC) AS rn
-                FROM argo_measurements
-                WHERE DATE_TRUNC('month', time) = (
-                    SELECT DATE_TRUNC('month', MAX(time))
-                    FROM argo_measurements
-                )
-            )
-            SELECT platform_number AS id, latitude, longitude, time AS "lastReported"
-            FROM latest_measurements
-            WHERE rn = 1;
-        """)
+    """
+    Fetch latest floats from DB and swap them into the global cache.
+    The new list is built off to the side, so readers see either the old
+    cache or the new one; if the fetch fails the old cache is kept.
+    """
+    global float_cache, floats_bytes, floats_gzip
+    with float_refresh_lock:
+        try:
+            print("🌊 Loading float cache...")
 
-        with engine.connect() as connection:
-            df = pd.read_sql(query, connection)
+            # Stream rows from a server-side cursor and convert each chunk as it
+            # arrives, to the FloatLocation field types with ISO timestamps
+            new_cache = []
+            with engine.connect().execution_options(stream_results=True, yield_per=FLOAT_CACHE_CHUNK_ROWS) as connection:
+                for chunk in connection.execute(QUERY_LATEST_FLOATS).mappings().partitions():
+                    new_cache.extend(
+                        {
+                            "id": str(row["id"]),
+                            "latitude": float(row["latitude"]),
+                            "longitude": float(row["longitude"]),
+                            "lastReported": row["lastReported"].isoformat(),
+                        }
+                        for row in chunk
+                    )
 
-        if df.empty:
-            print("❌ No float data found in database")
-            float_cache = []
-            return
+            if not new_cache:
+                print("❌ No float data found in database")
 
-        # Convert timestamps to ISO format
-        df['lastReported'] = df['lastReported'].apply(lambda x: x.isoformat())
-        float_cache = df.to_dict(orient='records')
+            new_bytes = orjson.dumps(new_cache)
+            new_gzip = gzip.compress(new_bytes, compresslevel=6)
+            float_cache, floats_bytes, floats_gzip = new_cache, new_bytes, new_gzip
 
-        print(f"✅ Float cache loaded with {len(float_cache)} floats")
+            print(f"✅ Float cache loaded with {len(float_cache)} floats")
 
-    except Exception as e:
-        print(f"❌ Failed to load float cache: {str(e)}")
-        float_cache = []
+        except Exception as e:
+            print(f"❌ Failed to load float cache, keeping {len(float_cache)} cached floats: {str(e)}")
+
+async def refresh_float_cache_periodically():
+    """Rebuild the float cache in a worker thread every FLOAT_CACHE_REFRESH_SECONDS"""
+    while True:
+        await asyncio.sleep(FLOAT_CACHE_REFRESH_SECONDS)
+        await asyncio.to_thread(load_float_cache)
 
 # --- 7. STARTUP EVENT ---
 @app.on_event("startup")
 async def on_startup():
-    """Load float cache when the app starts"""
-    load_float_cache()
+    """Load float cache when the app starts and keep it refreshed"""
+    await asyncio.to_thread(load_float_cache)
+    app.state.float_refresh_task = asyncio.create_task(refresh_float_cache_periodically())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Stop the periodic float cache refresh"""
+    app.state.float_refresh_task.cancel()
 
 # --- 8. API ENDPOINTS ---
 @app.get("/health")
@@ -112,13 +178,12 @@ async def root():
     return {"message": "Argo Float Data API", "version": "2.0.0"}
 
 @app.get("/test-db")
-async def test_database():
+def test_database():
     """Test database connection with a simple query"""
     try:
         print("🔍 Testing database connection...")
-        query = text("SELECT COUNT(*) as count FROM argo_measurements LIMIT 1")
         with engine.connect() as connection:
-            result = connection.execute(query)
+            result = connection.execute(QUERY_ROW_COUNT)
             count = result.fetchone()[0]
         print(f"✅ Database test successful. Row count: {count}")
         return {"status": "success", "row_count": count}
@@ -127,21 +192,12 @@ async def test_database():
         return {"status": "error", "message": str(e)}
 
 @app.get("/test-floats")
-async def test_floats():
+def test_floats():
     """Test getting a few float records"""
     try:
         print("🔍 Testing float data retrieval...")
-        query = text("""
-            SELECT 
-                platform_number AS id,
-                latitude,
-                longitude,
-                time AS "lastReported"
-            FROM argo_measurements
-            LIMIT 5;
-        """)
         with engine.connect() as connection:
-            df = pd.read_sql(query, connection)
+            df = pd.read_sql(QUERY_TEST_FLOATS, connection)
         print(f"✅ Retrieved {len(df)} test records")
         df['lastReported'] = df['lastReported'].apply(lambda x: x.isoformat())
         result = df.to_dict(orient='records')
@@ -150,53 +206,90 @@ async def test_floats():
         print(f"❌ Test floats failed: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (q=0 means no)"""
+    gzip_q = wildcard_q = None
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            gzip_q = q
+        elif coding == "*":
+            wildcard_q = q
+    if gzip_q is None:
+        gzip_q = wildcard_q  # "*" covers codings not listed by name
+    return gzip_q is not None and gzip_q > 0
+
 @app.get("/api/floats", response_model=List[FloatLocation])
-async def get_float_locations():
-    """Return pre-fetched float locations from cache"""
-    global float_cache
+async def get_float_locations(request: Request):
+    """Return pre-fetched float locations from cache, already serialized (and compressed)"""
     print(f"🎯 Returning {len(float_cache)} cached float locations")
-    return float_cache
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=floats_gzip, media_type="application/json", headers=headers)
+    return Response(content=floats_bytes, media_type="application/json", headers=headers)
 
 @app.get("/api/refresh-floats")
-async def refresh_float_cache():
-    """Manually refresh the float cache"""
-    load_float_cache()
-    return {"status": "success", "message": f"Float cache refreshed with {len(float_cache)} floats"}
+async def refresh_float_cache(background_tasks: BackgroundTasks):
+    """Manually refresh the float cache; the rebuild runs after the response is sent"""
+    background_tasks.add_task(load_float_cache)
+    return {"status": "success", "message": f"Float cache refresh started, currently serving {len(float_cache)} floats"}
 
 @app.get("/api/float/{float_id}", response_model=ArgoFloat)
-async def get_float_details(float_id: str):
+def get_float_details(float_id: str):
     """Get all measurements for a single float"""
-    query = text("""
-        SELECT * FROM argo_measurements
-        WHERE platform_number = :id
-        ORDER BY time;
-    """)
+    with float_detail_lock:
+        cached = float_detail_cache.get(float_id)
+        if cached and cached[0] > time.monotonic():
+            float_detail_cache.move_to_end(float_id)
+            return Response(content=cached[1], media_type="application/json")
+
     with engine.connect() as connection:
-        df = pd.read_sql(query, connection, params={'id': float_id})
+        df = pd.read_sql(QUERY_FLOAT_DETAILS, connection, params={'id': float_id})
     if df.empty:
-        return {"error": "Float not found"}
+        raise HTTPException(status_code=404, detail="Float not found")
 
     latest_data = df.iloc[-1]
 
-    temp_points = [
-        MeasurementPoint(date=row['time'].isoformat(), value=row.get('temp_adjusted'), latitude=row['latitude'], longitude=row['longitude'])
-        for _, row in df.iterrows() if pd.notna(row.get('temp_adjusted'))
-    ]
-    salinity_points = [
-        MeasurementPoint(date=row['time'].isoformat(), value=row.get('psal_adjusted'), latitude=row['latitude'], longitude=row['longitude'])
-        for _, row in df.iterrows() if pd.notna(row.get('psal_adjusted'))
-    ]
-    pressure_points = [
-        MeasurementPoint(date=row['time'].isoformat(), value=row.get('pres_adjusted'), latitude=row['latitude'], longitude=row['longitude'])
-        for _, row in df.iterrows() if pd.notna(row.get('pres_adjusted'))
-    ]
-
-    return ArgoFloat(
-        id=str(latest_data['platform_number']),
-        latitude=latest_data['latitude'],
-        longitude=latest_data['longitude'],
-        lastReported=latest_data['time'].isoformat(),
-        temperature=temp_points,
-        salinity=salinity_points,
-        pressure=pressure_points,
-    )
+    # Format timestamps and pull coordinates once for all three parameters
+    dates = [t.isoformat() for t in df['time']]
+    latitudes = df['latitude'].to_numpy(dtype=float)
+    longitudes = df['longitude'].to_numpy(dtype=float)
+
+    # Plain dicts shaped like MeasurementPoint/ArgoFloat; orjson encodes them
+    # directly, without building and dumping a model per point
+    def measurement_points(column: str) -> List[dict]:
+        values = df[column].to_numpy(dtype=float)
+        idx = np.flatnonzero(~np.isnan(values))
+        return [
+            {"date": dates[i], "value": value, "latitude": lat, "longitude": lon}
+            for i, value, lat, lon in zip(idx.tolist(), values[idx].tolist(), latitudes[idx].tolist(), longitudes[idx].tolist())
+        ]
+
+    argo_float = {
+        "id": str(latest_data['platform_number']),
+        "latitude": float(latest_data['latitude']),
+        "longitude": float(latest_data['longitude']),
+        "lastReported": latest_data['time'].isoformat(),
+        "temperature": measurement_points('temp_adjusted'),
+        "salinity": measurement_points('psal_adjusted'),
+        "pressure": measurement_points('pres_adjusted'),
+    }
+    body = orjson.dumps(argo_float)
+
+    with float_detail_lock:
+        float_detail_cache[float_id] = (time.monotonic() + FLOAT_DETAIL_CACHE_TTL, body)
+        float_detail_cache.move_to_end(float_id)
+        if len(float_detail_cache) > FLOAT_DETAIL_CACHE_SIZE:
+            float_detail_cache.popitem(last=False)
+
+    return Response(content=body, media_type="application/json")
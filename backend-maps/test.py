@@ -1,8 +1,16 @@
-import pandas as pd
-from fastapi import FastAPI
+import asyncio
+import os
+import threading
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
+from typing import Iterator, List
 
 # --- 1. INITIALIZE FASTAPI APP ---
 app = FastAPI(title="Argo Float Data API")
@@ -38,71 +46,202 @@ class ArgoFloat(BaseModel):
 
 
 # --- 3. REVISED DATA PROCESSING FUNCTION ---
-def process_argo_data(file_path: str) -> List[ArgoFloat]:
+ARGO_COLUMN_TYPES = {
+    'platform_number': pa.string(),
+    'time': pa.timestamp('s', tz='UTC'),
+    'latitude': pa.float64(),
+    'longitude': pa.float64(),
+    'pres': pa.float64(),
+    'temp': pa.float64(),
+    'psal': pa.float64(),
+}
+
+ARGO_SCHEMA = pa.schema(list(ARGO_COLUMN_TYPES.items()))
+# A decimal number as written in the CSV, e.g. 29.232, -5, 1e-3
+ARGO_NUMBER_PATTERN = r'^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$'
+
+def coerce_argo_column(values: pa.ChunkedArray, column_type: pa.DataType) -> pa.ChunkedArray:
+    """Convert a text column to column_type, turning values that do not parse into nulls"""
+    try:
+        return values.cast(column_type)
+    except pa.ArrowInvalid:
+        pass
+    if pa.types.is_timestamp(column_type):
+        return pc.strptime(values, format='%Y-%m-%dT%H:%M:%SZ', unit='s', error_is_null=True).cast(column_type)
+    numeric = pc.match_substring_regex(values, ARGO_NUMBER_PATTERN)
+    return pc.if_else(numeric, values, pa.scalar(None, pa.string())).cast(column_type)
+
+def load_argo_table(file_path: str) -> pa.Table | None:
+    """
+    Load the cleaned Argo rows, sorted by float, time and pressure.
+    The result is kept in a Parquet file next to the CSV and reused for as
+    long as it is newer than the CSV. Returns None if the CSV is missing.
+    """
+    sidecar_path = os.path.splitext(file_path)[0] + '.parquet'
+    try:
+        csv_mtime = os.path.getmtime(file_path)
+    except FileNotFoundError:
+        return None
     try:
-        df = pd.read_csv(file_path, header=0, low_memory=False, parse_dates=['time'])
+        if os.path.getmtime(sidecar_path) >= csv_mtime:
+            # Parquet stores second timestamps as milliseconds, cast them back
+            return pq.read_table(sidecar_path).cast(ARGO_SCHEMA)
+    except (OSError, pa.ArrowInvalid):
+        pass  # No usable sidecar, parse the CSV
+
+    # Parse with Arrow's multithreaded reader, typing only the columns we use.
+    # The second line of the file is a units row (UTC, degrees_north, ...).
+    # Rows with the wrong number of fields are skipped rather than failing.
+    read_options = csv.ReadOptions(skip_rows_after_names=1)
+    parse_options = csv.ParseOptions(invalid_row_handler=lambda row: 'skip')
+    try:
+        table = csv.read_csv(
+            file_path,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=csv.ConvertOptions(column_types=ARGO_COLUMN_TYPES, include_columns=list(ARGO_COLUMN_TYPES)),
+        )
     except FileNotFoundError:
-        return []
+        return None
+    except pa.ArrowInvalid:
+        # Some cell does not parse as its column's type. Read the columns as
+        # text instead and turn only the bad values into nulls, so the filter
+        # below drops their rows rather than the whole file failing
+        table = csv.read_csv(
+            file_path,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=csv.ConvertOptions(
+                column_types={col: pa.string() for col in ARGO_COLUMN_TYPES},
+                include_columns=list(ARGO_COLUMN_TYPES),
+                strings_can_be_null=True,
+            ),
+        )
+        table = pa.table({
+            col: coerce_argo_column(table[col], column_type)
+            for col, column_type in ARGO_COLUMN_TYPES.items()
+        })
 
-    df['platform_number'] = df['platform_number'].astype(str)
-    numeric_cols = ['latitude', 'longitude', 'temp', 'psal', 'pres']
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    
     # Drop rows where essential data is missing
-    df.dropna(subset=['time', 'platform_number', 'pres', 'temp', 'psal'], inplace=True)
-    
-    all_floats_data = []
-    # Group by each unique float
-    for float_id, float_df in df.groupby('platform_number'):
-        
+    valid = pc.is_valid(table['time'])
+    for col in ('platform_number', 'pres', 'temp', 'psal'):
+        valid = pc.and_(valid, pc.is_valid(table[col]))
+    table = table.filter(valid)
+
+    # One stable sort orders the floats, each float's profiles by time and each
+    # profile by pressure (depth), so every group is a contiguous run of rows
+    table = table.take(pc.sort_indices(table, sort_keys=[
+        ('platform_number', 'ascending'), ('time', 'ascending'), ('pres', 'ascending'),
+    ]))
+
+    # Write the sidecar under a temporary name so readers never see half of it
+    try:
+        pq.write_table(table, sidecar_path + '.tmp', compression='zstd')
+        os.replace(sidecar_path + '.tmp', sidecar_path)
+    except OSError:
+        pass  # Read-only data directory; parse again next time
+    return table
+
+def iter_argo_floats(file_path: str) -> Iterator[dict]:
+    """
+    Yield one float at a time, so only the current float's data is alive.
+    Floats are plain dicts shaped like ArgoFloat; the models only describe the
+    response schema.
+    """
+    table = load_argo_table(file_path)
+    if table is None or table.num_rows == 0:
+        return
+
+    # The rows are sorted by id, so a new float starts wherever the id differs
+    # from the previous row's. The comparison runs in Arrow, so the per-row id
+    # strings are never materialized; only one id per float is taken.
+    ids = table['platform_number']
+    id_change = pc.not_equal(ids[1:], ids[:-1]).to_numpy(zero_copy_only=False)
+    float_starts = np.flatnonzero(np.r_[True, id_change])
+    float_ends = np.r_[float_starts[1:], table.num_rows]
+    float_ids = ids.take(float_starts).to_pylist()
+
+    # A new profile starts at each new float and wherever the time changes
+    profile_change = id_change | (np.diff(table['time'].to_numpy()) != np.timedelta64(0))
+    profile_starts = np.flatnonzero(np.r_[True, profile_change])
+    profile_ends = np.r_[profile_starts[1:], table.num_rows]
+    # Each float's profiles are the runs starting inside its rows
+    float_first = np.searchsorted(profile_starts, float_starts).tolist()
+    float_last = np.searchsorted(profile_starts, float_ends).tolist()
+
+    # From here on only plain arrays are indexed, one per column
+    cols = {
+        col: table[col].to_numpy()
+        for col in ('latitude', 'longitude', 'pres', 'temp', 'psal')
+    }
+    lat, lon = cols['latitude'], cols['longitude']
+    pres, temp, psal = cols['pres'], cols['temp'], cols['psal']
+    # Format every profile's ISO date in one kernel call. Times are read as
+    # second-resolution UTC, which isoformat() renders with a +00:00 offset
+    profile_dates = pc.strftime(table['time'].take(profile_starts), format='%Y-%m-%dT%H:%M:%S+00:00').to_pylist()
+
+    for float_id, first, last in zip(float_ids, float_first, float_last):
         profiles_list = []
-        # Now, group that float's data by each unique profile time
-        for profile_time, profile_df in float_df.groupby('time'):
-            
-            # Sort measurements by pressure (depth) for a clean profile
-            profile_df = profile_df.sort_values(by='pres')
-            
+        for k in range(first, last):
+            start, end = profile_starts[k], profile_ends[k]
+            # tolist() hands over Python floats in one C call per column
             measurements_list = [
-                Measurement(
-                    pressure=row['pres'],
-                    temperature=row['temp'],
-                    salinity=row['psal']
-                )
-                for index, row in profile_df.iterrows()
+                {"pressure": p, "temperature": t, "salinity": s}
+                for p, t, s in zip(pres[start:end].tolist(), temp[start:end].tolist(), psal[start:end].tolist())
             ]
-            
-            profiles_list.append(
-                Profile(
-                    date=profile_time.isoformat(),
-                    measurements=measurements_list
-                )
-            )
 
-        # Sort profiles by date
-        profiles_list.sort(key=lambda p: p.date)
+            profiles_list.append({"date": profile_dates[k], "measurements": measurements_list})
 
         if not profiles_list:
             continue
 
-        # Get latest data from the last profile
-        last_profile_df = float_df[float_df['time'] == pd.to_datetime(profiles_list[-1].date)]
-        latest_pos = last_profile_df.iloc[-1]
-
-        all_floats_data.append(
-            ArgoFloat(
-                id=float_id,
-                latitude=latest_pos['latitude'],
-                longitude=latest_pos['longitude'],
-                lastReported=profiles_list[-1].date,
-                profiles=profiles_list
-            )
-        )
-        
-    return all_floats_data
+        # Get latest data from the last profile: the final row of the float's
+        # last run, since profiles are already in time order
+        latest_idx = profile_ends[last - 1] - 1
+
+        yield {
+            "id": float_id,
+            "latitude": float(lat[latest_idx]),
+            "longitude": float(lon[latest_idx]),
+            "lastReported": profiles_list[-1]["date"],
+            "profiles": profiles_list,
+        }
+
+# --- 4. THE API ENDPOINT ---
+# Processed floats as serialized JSON, reused until the CSV's mtime changes
+floats_cache = {"mtime": None, "body": b"[]"}
+floats_cache_lock = threading.Lock()  # One rebuild at a time
+
+def refresh_floats_cache(file_path: str, mtime: float):
+    """Rebuild the cached JSON for the given CSV version, unless already done"""
+    with floats_cache_lock:
+        if mtime == floats_cache["mtime"]:
+            return  # Built by a concurrent request while we waited
+        try:
+            # Encode each float as it is produced, keeping only its bytes. The
+            # array brackets and separators go in the same list, so the body is
+            # built by a single join: peak memory is the pieces plus the body.
+            pieces = [b"["]
+            for argo_float in iter_argo_floats(file_path):
+                if len(pieces) > 1:
+                    pieces.append(b",")
+                pieces.append(orjson.dumps(argo_float))
+            pieces.append(b"]")
+            floats_cache["body"] = b"".join(pieces)
+        except Exception as e:
+            # Keep serving the last good body. The mtime is still recorded, so
+            # this version of the file is not parsed again on every request
+            print(f"❌ Failed to process {file_path}: {e}")
+        floats_cache["mtime"] = mtime
 
-# --- 4. THE API ENDPOINT (no changes here) ---
 @app.get("/api/floats", response_model=List[ArgoFloat])
 async def get_all_floats():
     file_path = 'argo_data.csv' # Use your smaller test file if needed
-    return process_argo_data(file_path)
\ No newline at end of file
+    try:
+        mtime = os.stat(file_path).st_mtime
+    except FileNotFoundError:
+        return Response(content=b"[]", media_type="application/json")
+    if mtime != floats_cache["mtime"]:
+        # Parsing blocks for a while, so keep it off the event loop
+        await asyncio.to_thread(refresh_floats_cache, file_path, mtime)
+    return Response(content=floats_cache["body"], media_type="application/json")
\ No newline at end of file